@@ -1,25 +1,81 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import qrcode
 import json
 import os
+import base64
+import bcrypt
 import hashlib
+import hmac
+import functools
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from io import BytesIO
-import base64
-from ultralytics import YOLO
-import tempfile
-import cv2
-import numpy as np
-import pandas as pd
+import re
+import secrets
+import sqlite3
+import queue
+import threading
+import time
 
 # ---------------------------
 # File paths
 # ---------------------------
+DB_PATH = "app.db"
+# Legacy JSON stores, imported into DB_PATH when the database is first created
 USERS_FILE = "users.json"
 PENDING_FILE = "pending_users.json"
 DB_FILE = "scans.json"
 SECURITY_FILE = "security_accounts.json"
-MODEL_PATH = "best.pt"  # <-- Your AI model file
+# Your AI model file. Exported models matching the host are preferred when present:
+# (dynamic=True and batch=ID_BATCH_SIZE let exports take batched ID checks)
+#   yolo export model=best.pt format=engine half=True imgsz=640 dynamic=True batch=8    (TensorRT FP16, NVIDIA GPU)
+#   yolo export model=best.pt format=openvino imgsz=640 dynamic=True batch=8            (CPU, needs openvino)
+#   yolo export model=best.pt format=onnx imgsz=640 simplify=True dynamic=True batch=8  (CPU, needs onnxruntime)
+MODEL_PATH = "best.pt"
+GPU_MODEL_CANDIDATES = ("best.engine", MODEL_PATH)
+CPU_MODEL_CANDIDATES = ("best_openvino_model", "best.onnx", MODEL_PATH)
+
+# Pre-model sanity gate for ID photos (ID-1 cards are ~1.586:1)
+ID_ASPECT_RANGE = (1.3, 1.9)
+ID_EDGE_DENSITY_RANGE = (0.02, 0.3)
+ID_CONFIDENCE = 0.70
+MODEL_IMGSZ = 640
+
+# Concurrent ID checks are grouped into one YOLO batch
+ID_BATCH_SIZE = 8
+ID_BATCH_WAIT_SECONDS = 0.05
+ID_RESULT_TIMEOUT_SECONDS = 30
+
+# The countdown ticks in the browser; the server only re-checks visitor state
+STATUS_REFRESH_SECONDS = 30
+
+COUNTDOWN_HTML = """
+<div id="countdown" style="font-family: sans-serif; padding: 0.75rem 1rem; border-radius: 0.5rem;
+    background: rgba(33, 195, 84, 0.1); color: rgb(23, 114, 51);"></div>
+<script>
+const end = %(end_ms)d;
+const label = %(label)s;
+const el = document.getElementById("countdown");
+const pad = (n) => String(n).padStart(2, "0");
+function tick() {
+    const left = Math.max(0, Math.floor((end - Date.now()) / 1000));
+    if (left === 0) {
+        el.textContent = "⏱ Visitor's estimated time has expired.";
+        el.style.background = "rgba(255, 43, 43, 0.09)";
+        el.style.color = "rgb(125, 53, 59)";
+        clearInterval(timer);
+        return;
+    }
+    el.textContent = label + ": " + Math.floor(left / 3600) + ":" + pad(Math.floor(left / 60) %% 60) + ":" + pad(left %% 60);
+}
+const timer = setInterval(tick, 1000);
+tick();
+</script>
+"""
+
+BCRYPT_PREFIX = "bcrypt-sha256$"
+
+_NUM_RE = re.compile(r"\s*(\d+(?:\.\d+)?)")
 
 # ---------------------------
 # Helpers
@@ -30,69 +86,336 @@ def load_json(file_path):
             return json.load(f)
     return {}
 
-def save_json(file_path, data):
-    with open(file_path, "w") as f:
-        json.dump(data, f, indent=4)
+def _bcrypt_input(password: str):
+    # bcrypt rejects input over 72 bytes, so hash a fixed-size digest instead
+    return base64.b64encode(hashlib.sha256(password.encode()).digest())
 
 def hash_password(password: str):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return BCRYPT_PREFIX + bcrypt.hashpw(_bcrypt_input(password), bcrypt.gensalt(rounds=12)).decode()
 
-def verify_password(stored_hash: str, plain_password: str):
-    return stored_hash == hash_password(plain_password)
+def is_legacy_hash(stored_hash: str):
+    # Older accounts store an unsalted SHA-256 hex digest or bcrypt of the raw password
+    return not stored_hash.startswith(BCRYPT_PREFIX)
 
-def generate_qr(data: str):
+def verify_password(stored_hash: str, plain_password: str):
+    if stored_hash.startswith(BCRYPT_PREFIX):
+        return bcrypt.checkpw(_bcrypt_input(plain_password), stored_hash[len(BCRYPT_PREFIX):].encode())
+    if stored_hash.startswith("$2"):
+        password = plain_password.encode()
+        return len(password) <= 72 and bcrypt.checkpw(password, stored_hash.encode())
+    digest = hashlib.sha256(plain_password.encode()).digest()
+    return hmac.compare_digest(bytes.fromhex(stored_hash), digest)
+
+@st.cache_data(max_entries=256)
+def generate_qr(data: str) -> bytes:
+    import cv2
+    import numpy as np
     qr = qrcode.QRCode(version=1, box_size=8, border=4)
     qr.add_data(data)
     qr.make(fit=True)
-    img = qr.make_image(fill="black", back_color="white")
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return buf.getvalue()
+    # Scale the module matrix (border included) straight to pixels; skips PIL
+    modules = np.array(qr.get_matrix(), dtype=np.uint8)
+    img = np.kron(1 - modules, np.ones((qr.box_size, qr.box_size), np.uint8)) * 255
+    _, png = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9])
+    return png.tobytes()
+
+@functools.lru_cache(maxsize=4)
+def _end_of_day(year, month, day):
+    return datetime(year, month, day, 23, 59, 59)
+
+@functools.lru_cache(maxsize=256)
+def iso_timestamp(value):
+    # ISO strings of a visitor record never change, so convert each one once
+    return datetime.fromisoformat(value).timestamp()
 
 def get_end_of_day():
     now = datetime.now()
-    return datetime(now.year, now.month, now.day, 23, 59, 59)
+    return _end_of_day(now.year, now.month, now.day)
 
+@functools.lru_cache(maxsize=256)
 def parse_estimated_time(time_str):
-    """Smart time parser – handles 1h, 1 hr, 1 hour, 30 mins, etc."""
+    """Smart time parser – handles 1h, 1 hr, 1 hour, 30 mins, 1:30, etc."""
     s = (time_str or "").lower().strip()
+    m = _NUM_RE.match(s)
+    if not m:
+        return timedelta(minutes=30)
+    num = float(m.group(1))
+    tail = s[m.end():].lstrip()
     try:
-        if "hour" in s or "hr" in s or (s.endswith("h") and len(s) > 1):
-            num_token = s.split()[0].replace("h", "").replace("hr", "")
-            num = float(num_token)
+        if tail.startswith(":"):  # 1:30 -> 1 hour 30 mins
+            mins = _NUM_RE.match(tail, 1)
+            return timedelta(hours=num, minutes=float(mins.group(1)) if mins else 0)
+        if "h" in tail:
             return timedelta(hours=num)
-        if "min" in s or (s.endswith("m") and len(s) > 1):
-            num_token = s.split()[0].replace("min", "").replace("m", "")
-            num = float(num_token)
-            return timedelta(minutes=num)
-        if ":" in s:  # 1:30 -> 1 hour 30 mins
-            h, m = s.split(":")
-            return timedelta(hours=int(h), minutes=int(m))
-    except Exception:
-        pass
-    return timedelta(minutes=30)
+        return timedelta(minutes=num)
+    except (OverflowError, ValueError):  # absurdly large durations
+        return timedelta(minutes=30)
+
+def looks_like_id_card(img):
+    """Cheap aspect-ratio/edge-density check run before the YOLO model."""
+    import cv2
+    h, w = img.shape[:2]
+    aspect = max(w, h) / min(w, h)
+    if not ID_ASPECT_RANGE[0] <= aspect <= ID_ASPECT_RANGE[1]:
+        return False
+    edges = cv2.Canny(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), 80, 160)
+    density = edges.mean() / 255
+    return ID_EDGE_DENSITY_RANGE[0] <= density <= ID_EDGE_DENSITY_RANGE[1]
+
+def visit_end_timestamp(visitor):
+    duration = parse_estimated_time(visitor["estimated_time"]).total_seconds()
+    return iso_timestamp(visitor["scan_time"]) + duration
+
+def status_poll_interval(visitor):
+    # Once the QR or the visit is over nothing can change, so stop polling the server
+    now = time.time()
+    if iso_timestamp(visitor["expiry_time"]) <= now:
+        return None
+    if visitor.get("scan_time") and visit_end_timestamp(visitor) <= now:
+        return None
+    return STATUS_REFRESH_SECONDS
+
+def render_time_remaining(end_ts, label="Time Left"):
+    if end_ts <= time.time():
+        st.error("⏱ Visitor's estimated time has expired.")
+        return
+    components.html(
+        COUNTDOWN_HTML % {"end_ms": int(end_ts * 1000), "label": json.dumps(label)},
+        height=60,
+    )
+
+# ---------------------------
+# Database (SQLite)
+# ---------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_users (
+    email TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    password TEXT NOT NULL,
+    submitted_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS visitors (
+    token TEXT PRIMARY KEY,
+    visitor_name TEXT,
+    homeowner_name TEXT,
+    block_number TEXT,
+    purpose TEXT,
+    estimated_time TEXT,
+    scan_time TEXT,
+    expiry_time TEXT NOT NULL,
+    id_uploaded INTEGER NOT NULL DEFAULT 0,
+    id_filename TEXT
+);
+CREATE TABLE IF NOT EXISTS security_accounts (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+);
+"""
+
+DB_VERSION = 2
+
+# One connection is shared by every session; serialize access to it.
+_DB_LOCK = threading.Lock()
+
+def import_legacy_json(conn, version):
+    """Import the JSON stores that predate the given database version."""
+    if version < 1:
+        import_legacy_homeowner_json(conn)
+    if version < 2:
+        accounts = load_json(SECURITY_FILE) or []
+        conn.executemany(
+            "INSERT OR IGNORE INTO security_accounts (username, password) VALUES (:username, :password)",
+            accounts,
+        )
+
+def import_legacy_homeowner_json(conn):
+    users = load_json(USERS_FILE)
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (email, phone, password) VALUES (?, ?, ?)",
+        [(email, u["phone"], u["password"]) for email, u in users.items()],
+    )
+    pending = load_json(PENDING_FILE)
+    conn.executemany(
+        "INSERT OR IGNORE INTO pending_users (email, phone, password, submitted_at) VALUES (?, ?, ?, ?)",
+        [(email, p["phone"], p["password"], p["submitted_at"]) for email, p in pending.items()],
+    )
+    visitor = load_json(DB_FILE).get("visitor")
+    if visitor:
+        conn.execute(
+            "INSERT OR IGNORE INTO visitors (token, visitor_name, homeowner_name, block_number, purpose,"
+            " estimated_time, scan_time, expiry_time, id_uploaded, id_filename)"
+            " VALUES (:token, :visitor_name, :homeowner_name, :block_number, :purpose,"
+            " :estimated_time, :scan_time, :expiry_time, :id_uploaded, :id_filename)",
+            {"id_filename": None, **visitor},
+        )
+
+@st.cache_resource
+def get_db():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+        conn.executescript(SCHEMA)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < DB_VERSION:
+            import_legacy_json(conn, version)
+            conn.execute(f"PRAGMA user_version = {DB_VERSION}")
+    return conn
+
+def db_query(sql, params=()):
+    with _DB_LOCK:
+        return [dict(row) for row in get_db().execute(sql, params)]
+
+def db_execute(*statements):
+    """Run (sql, params) pairs in one transaction; return the last rowcount."""
+    with _DB_LOCK, get_db() as conn:
+        rowcount = 0
+        for sql, params in statements:
+            rowcount = conn.execute(sql, params).rowcount
+        return rowcount
+
+def get_user(email):
+    rows = db_query("SELECT * FROM users WHERE email = ?", (email,))
+    return rows[0] if rows else None
+
+def set_user_password(email, password_hash):
+    db_execute(("UPDATE users SET password = ? WHERE email = ?", (password_hash, email)))
+
+def get_pending_user(email):
+    rows = db_query("SELECT * FROM pending_users WHERE email = ?", (email,))
+    return rows[0] if rows else None
+
+def load_pending_users():
+    rows = db_query("SELECT * FROM pending_users ORDER BY submitted_at")
+    return {row.pop("email"): row for row in rows}
+
+def add_pending_user(email, phone, password_hash):
+    return db_execute((
+        "INSERT OR IGNORE INTO pending_users (email, phone, password, submitted_at) VALUES (?, ?, ?, ?)",
+        (email, phone, password_hash, datetime.now().isoformat()),
+    )) > 0
+
+def approve_pending_user(email):
+    db_execute(
+        ("INSERT OR REPLACE INTO users (email, phone, password)"
+         " SELECT email, phone, password FROM pending_users WHERE email = ?", (email,)),
+        ("DELETE FROM pending_users WHERE email = ?", (email,)),
+    )
+
+def reject_pending_user(email):
+    db_execute(("DELETE FROM pending_users WHERE email = ?", (email,)))
+
+def get_visitor(token):
+    rows = db_query("SELECT * FROM visitors WHERE token = ?", (token,))
+    return rows[0] if rows else None
+
+def get_latest_visitor():
+    rows = db_query("SELECT * FROM visitors ORDER BY rowid DESC LIMIT 1")
+    return rows[0] if rows else None
+
+def add_visitor(visitor):
+    db_execute((
+        "INSERT INTO visitors (token, visitor_name, homeowner_name, block_number, purpose,"
+        " estimated_time, expiry_time) VALUES (:token, :visitor_name, :homeowner_name,"
+        " :block_number, :purpose, :estimated_time, :expiry_time)",
+        visitor,
+    ))
+
+def update_visitor(token, **fields):
+    assignments = ", ".join(f"{column} = :{column}" for column in fields)
+    db_execute((f"UPDATE visitors SET {assignments} WHERE token = :token", {**fields, "token": token}))
 
 # ---------------------------
 # Security accounts helpers
 # ---------------------------
-def ensure_security_file():
-    if not os.path.exists(SECURITY_FILE):
-        save_json(SECURITY_FILE, [])
+def get_security_account(username):
+    rows = db_query("SELECT * FROM security_accounts WHERE username = ?", (username,))
+    return rows[0] if rows else None
 
 def load_security_accounts():
-    ensure_security_file()
-    return load_json(SECURITY_FILE)
-
-def save_security_accounts(accounts):
-    save_json(SECURITY_FILE, accounts)
+    return db_query("SELECT username FROM security_accounts ORDER BY username")
 
 def add_security_account(username, password_plain):
-    accounts = load_security_accounts()
-    if any(a["username"] == username for a in accounts):
-        return False
-    accounts.append({"username": username, "password": hash_password(password_plain)})
-    save_security_accounts(accounts)
-    return True
+    return db_execute((
+        "INSERT OR IGNORE INTO security_accounts (username, password) VALUES (?, ?)",
+        (username, hash_password(password_plain)),
+    )) > 0
+
+def set_security_password(username, password_plain):
+    db_execute((
+        "UPDATE security_accounts SET password = ? WHERE username = ?",
+        (hash_password(password_plain), username),
+    ))
+
+# ---------------------------
+# AI model
+# ---------------------------
+@st.cache_resource
+def get_yolo_model():
+    """Load the model once; return it, the predict() kwargs and the largest usable batch."""
+    import numpy as np
+    import torch
+    from ultralytics import YOLO
+    on_gpu = torch.cuda.is_available()
+    # TensorRT needs CUDA, and the CPU exports would leave a GPU idle
+    candidates = GPU_MODEL_CANDIDATES if on_gpu else CPU_MODEL_CANDIDATES
+    model_path = next((p for p in candidates if os.path.exists(p)), MODEL_PATH)
+    model = YOLO(model_path, task="detect")
+    if on_gpu:
+        # Let any remaining FP32 matmuls use TF32 tensor cores
+        torch.set_float32_matmul_precision("high")
+    predict_args = {
+        "conf": ID_CONFIDENCE,
+        "iou": 0.5,
+        "max_det": 5,
+        "classes": [cls for cls, name in model.names.items() if "id" in name.lower()],
+        "imgsz": MODEL_IMGSZ,
+        "device": 0 if on_gpu else "cpu",
+        "half": on_gpu,  # FP16 halves activation bandwidth on CUDA
+        "verbose": False,
+    }
+    # Warm-up pass so the first visitor does not pay the setup cost
+    model.predict(np.zeros((MODEL_IMGSZ, MODEL_IMGSZ, 3), dtype=np.uint8), **predict_args)
+    # Exports without dynamic axes only accept a batch of one image
+    batchable = model_path == MODEL_PATH or getattr(model.predictor.model, "dynamic", False)
+    return model, predict_args, ID_BATCH_SIZE if batchable else 1
+
+def id_batch_worker(requests, model, predict_args, max_batch):
+    while True:
+        batch = [requests.get()]
+        deadline = time.monotonic() + ID_BATCH_WAIT_SECONDS
+        while len(batch) < max_batch:
+            try:
+                batch.append(requests.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        try:
+            results = model.predict([img for img, _ in batch], **predict_args)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            continue
+        # predict() already dropped boxes below ID_CONFIDENCE and non-ID classes
+        for (_, future), result in zip(batch, results):
+            future.set_result(len(result.boxes) > 0)
+
+@st.cache_resource
+def get_id_queue():
+    requests = queue.Queue()
+    threading.Thread(target=id_batch_worker, args=(requests, *get_yolo_model()), daemon=True).start()
+    return requests
+
+def detect_id(img):
+    """Queue one image for batched YOLO inference; True if an ID was found."""
+    future = Future()
+    get_id_queue().put((img, future))
+    return future.result(timeout=ID_RESULT_TIMEOUT_SECONDS)
 
 # ---------------------------
 # Registration Page (homeowner)
@@ -100,9 +423,6 @@ def add_security_account(username, password_plain):
 def page_register():
     st.title("🏠 Homeowner Registration")
 
-    pending = load_json(PENDING_FILE)
-    users = load_json(USERS_FILE)
-
     email = st.text_input("Email (used as username)")
     phone = st.text_input("Phone Number")
     password = st.text_input("Password", type="password")
@@ -113,17 +433,11 @@ def page_register():
             st.error("Please fill all fields.")
         elif password != confirm:
             st.error("Passwords do not match.")
-        elif email in users:
+        elif get_user(email):
             st.warning("This email is already approved.")
-        elif email in pending:
+        elif not add_pending_user(email, phone, hash_password(password)):
             st.warning("This email is already awaiting admin approval.")
         else:
-            pending[email] = {
-                "phone": phone,
-                "password": hash_password(password),
-                "submitted_at": datetime.now().isoformat(),
-            }
-            save_json(PENDING_FILE, pending)
             st.success("✅ Registration request sent for admin approval.")
             st.info("Please wait until your account is approved.")
             st.session_state["show_login"] = True
@@ -135,20 +449,21 @@ def page_register():
 def page_login():
     st.title("🔐 Homeowner Login")
 
-    users = load_json(USERS_FILE)
-
     email = st.text_input("Email")
     password = st.text_input("Password", type="password")
 
     if st.button("Login"):
-        if email not in users:
+        user = get_user(email)
+        if user is None:
             st.error("Email not registered or not yet approved.")
-        elif users[email]["password"] != hash_password(password):
+        elif not verify_password(user["password"], password):
             st.error("Incorrect password.")
         else:
+            if is_legacy_hash(user["password"]):
+                set_user_password(email, hash_password(password))
             st.session_state["logged_in"] = True
             st.session_state["email"] = email
-            st.session_state["phone"] = users[email]["phone"]
+            st.session_state["phone"] = user["phone"]
             st.success("✅ Login successful!")
             st.rerun()
 
@@ -172,25 +487,20 @@ def page_generator(public_url):
     estimated_time = st.text_input("Estimated Time of Stay (e.g., 1 hour, 30 mins)")
 
     if st.button("Generate QR Link"):
-        token = base64.urlsafe_b64encode(os.urandom(6)).decode("utf-8")
+        token = secrets.token_urlsafe(9)
         scan_link = f"{public_url}/?page=Visitor&token={token}"
 
         expiry_time = get_end_of_day()
 
-        data = {
-            "visitor": {
-                "token": token,
-                "visitor_name": visitor_name,
-                "homeowner_name": homeowner_email,
-                "block_number": block_number,
-                "purpose": purpose,
-                "estimated_time": estimated_time,
-                "scan_time": None,
-                "expiry_time": expiry_time.isoformat(),
-                "id_uploaded": False,
-            }
-        }
-        save_json(DB_FILE, data)
+        add_visitor({
+            "token": token,
+            "visitor_name": visitor_name,
+            "homeowner_name": homeowner_email,
+            "block_number": block_number,
+            "purpose": purpose,
+            "estimated_time": estimated_time,
+            "expiry_time": expiry_time.isoformat(),
+        })
 
         st.success(f"✅ Share this link with the visitor:\n{scan_link}")
         st.info(f"QR valid until **{expiry_time.strftime('%H:%M:%S')}** today")
@@ -202,13 +512,14 @@ def security_login_widget():
     st.subheader("Security Login")
     st.info("Only authorized security personnel can confirm entries.")
 
-    accounts = load_security_accounts()
     username = st.text_input("Username", key="sec_user")
     password = st.text_input("Password", type="password", key="sec_pass")
 
     if st.button("Login as Security"):
-        user = next((a for a in accounts if a["username"] == username), None)
+        user = get_security_account(username)
         if user and verify_password(user["password"], password):
+            if is_legacy_hash(user["password"]):
+                set_security_password(username, password)
             st.session_state["security_logged_in"] = True
             st.session_state["security_user"] = username
             st.success("✅ Security login successful.")
@@ -219,8 +530,17 @@ def security_login_widget():
 # ---------------------------
 # Visitor Page (AI ID verification)
 # ---------------------------
+def visitor_entry_status(token, polling):
+    visitor = get_visitor(token)
+    if polling and status_poll_interval(visitor) is None:
+        st.rerun()  # redraw the page without the status poll
+    if visitor.get("scan_time"):
+        st.subheader("⏳ Time Remaining")
+        render_time_remaining(visit_end_timestamp(visitor))
+    else:
+        st.info("⌛ Waiting for Security to confirm your entry.")
+
 def page_visitor():
-    from streamlit_autorefresh import st_autorefresh
     st.title("🙋 Visitor Check-In")
 
     query_params = st.query_params
@@ -230,15 +550,13 @@ def page_visitor():
         st.error("❌ Invalid or missing QR token")
         return
 
-    data = load_json(DB_FILE)
-    visitor = data.get("visitor", {})
+    visitor = get_visitor(token)
 
-    if not visitor or visitor.get("token") != token:
+    if not visitor:
         st.error("❌ QR Code not recognized")
         return
 
-    expiry_time = datetime.fromisoformat(visitor["expiry_time"])
-    if datetime.now() > expiry_time:
+    if time.time() > iso_timestamp(visitor["expiry_time"]):
         st.error("⏱ QR Expired (End of Day)")
         return
 
@@ -247,35 +565,30 @@ def page_visitor():
         uploaded_id = st.file_uploader("Upload your ID (Image Only)", type=["jpg", "jpeg", "png"])
 
         if uploaded_id:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-                tmp.write(uploaded_id.getvalue())
-                tmp_path = tmp.name
+            import cv2
+            import numpy as np
+            img = cv2.imdecode(np.frombuffer(uploaded_id.getvalue(), np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                st.error("❌ Could not read the uploaded image.")
+                return
+            # Phone photos are far larger than the model input; shrink them once here
+            h, w = img.shape[:2]
+            scale = MODEL_IMGSZ / max(h, w)
+            if scale < 1:
+                size = (max(1, int(w * scale)), max(1, int(h * scale)))
+                img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+            if not looks_like_id_card(img):
+                st.error("❌ No valid ID detected with sufficient confidence.")
+                return
 
             try:
-                model = YOLO(MODEL_PATH)
-                results = model.predict(tmp_path, conf=0.25, verbose=False)
+                found_valid_id = detect_id(img)
             except Exception as e:
-                os.remove(tmp_path)
                 st.error(f"Model error: {e}")
                 return
 
-            found_valid_id = False
-            if len(results) > 0 and hasattr(results[0], "boxes"):
-                for box in results[0].boxes:
-                    cls = int(box.cls)
-                    label = model.names[cls].lower()
-                    conf = float(box.conf) * 100.0
-                    if "id" in label and conf >= 70.0:
-                        found_valid_id = True
-                        break
-
-            os.remove(tmp_path)
-
             if found_valid_id:
-                visitor["id_uploaded"] = True
-                visitor["id_filename"] = uploaded_id.name
-                data["visitor"] = visitor
-                save_json(DB_FILE, data)
+                update_visitor(token, id_uploaded=1, id_filename=uploaded_id.name)
                 st.success("✅ Valid ID detected (confidence >= 70%).")
                 st.rerun()
             else:
@@ -290,25 +603,25 @@ def page_visitor():
     qr_bytes = generate_qr(scan_link)
     st.image(qr_bytes, caption="QR Code for Security to Scan")
 
-    if visitor.get("scan_time"):
-        st.subheader("⏳ Time Remaining")
-        scanned_at = datetime.fromisoformat(visitor["scan_time"])
-        estimated_duration = parse_estimated_time(visitor["estimated_time"])
-        end_time = scanned_at + estimated_duration
-        remaining = end_time - datetime.now()
-        if remaining.total_seconds() > 0:
-            st.success(f"Time Left: {str(remaining).split('.')[0]}")
-        else:
-            st.error("⏱ Visitor's estimated time has expired.")
-        st_autorefresh(interval=1000, key="visitor_refresh")
-    else:
-        st.info("⌛ Waiting for Security to confirm your entry.")
+    interval = status_poll_interval(visitor)
+    st.fragment(visitor_entry_status, run_every=interval)(token, polling=interval is not None)
 
 # ---------------------------
 # Security Page
 # ---------------------------
+def security_entry_panel(token, polling):
+    visitor = get_visitor(token)
+    if polling and status_poll_interval(visitor) is None:
+        st.rerun()  # redraw the page without the status poll
+    if not visitor.get("scan_time"):
+        if st.button("✅ Confirm Entry (Security)"):
+            update_visitor(token, scan_time=datetime.now().isoformat())
+            st.success("Entry confirmed. Timer started.")
+            st.rerun(scope="fragment")
+    else:
+        render_time_remaining(visit_end_timestamp(visitor), "⏳ Time Left")
+
 def page_security():
-    from streamlit_autorefresh import st_autorefresh
     st.title("🛡 Security Dashboard")
 
     if not st.session_state.get("security_logged_in", False):
@@ -318,20 +631,17 @@ def page_security():
     query_params = st.query_params
     token = query_params.get("token", None)
 
-    data = load_json(DB_FILE)
-    visitor = data.get("visitor")
+    visitor = get_visitor(token) if token else get_latest_visitor()
 
-    if token:
-        if not visitor or visitor.get("token") != token:
-            st.error("❌ Scanned QR not valid.")
-            return
+    if token and not visitor:
+        st.error("❌ Scanned QR not valid.")
+        return
 
     if not visitor:
         st.info("No active visitor records yet.")
         return
 
-    expiry_time = datetime.fromisoformat(visitor["expiry_time"])
-    if datetime.now() > expiry_time:
+    if time.time() > iso_timestamp(visitor["expiry_time"]):
         st.error("⏱ QR Expired (End of Day)")
         return
 
@@ -342,22 +652,8 @@ def page_security():
     st.write(f"**Purpose:** {visitor['purpose']}")
     st.write(f"**Estimated Time:** {visitor['estimated_time']}")
 
-    if not visitor.get("scan_time"):
-        if st.button("✅ Confirm Entry (Security)"):
-            visitor["scan_time"] = datetime.now().isoformat()
-            data["visitor"] = visitor
-            save_json(DB_FILE, data)
-            st.success("Entry confirmed. Timer started.")
-            st.rerun()
-    else:
-        scanned_at = datetime.fromisoformat(visitor["scan_time"])
-        estimated_duration = parse_estimated_time(visitor["estimated_time"])
-        remaining = scanned_at + estimated_duration - datetime.now()
-        if remaining.total_seconds() > 0:
-            st.success(f"⏳ Time Left: {str(remaining).split('.')[0]}")
-        else:
-            st.error("⏱ Visitor's estimated time has expired.")
-        st_autorefresh(interval=1000, key="security_refresh")
+    interval = status_poll_interval(visitor)
+    st.fragment(security_entry_panel, run_every=interval)(visitor["token"], polling=interval is not None)
 
     if st.sidebar.button("🔒 Security Logout"):
         st.session_state.pop("security_logged_in", None)
@@ -368,39 +664,18 @@ def page_security():
 # ---------------------------
 # Admin Page (Protected)
 # ---------------------------
-def page_admin():
-    st.title("🧑‍💼 Admin Dashboard - Approve New Accounts & Manage Security")
-
-    # 🔒 Admin login
-    if "admin_logged_in" not in st.session_state:
-        st.subheader("Admin Login Required")
-        username = st.text_input("Admin Username")
-        password = st.text_input("Admin Password", type="password")
-
-        if st.button("Login"):
-            admin_user = st.secrets["admin"]["username"]
-            admin_pass = st.secrets["admin"]["password"]
-            if username == admin_user and password == admin_pass:
-                st.session_state["admin_logged_in"] = True
-                st.success("✅ Logged in as Admin")
-                st.rerun()
-            else:
-                st.error("Invalid admin credentials.")
-        return
-
-    # ---- Main Admin UI ----
-    pending = load_json(PENDING_FILE)
-    users = load_json(USERS_FILE)
+@st.fragment
+def pending_registrations_panel():
+    pending = load_pending_users()
 
     st.subheader("Pending Homeowner Registrations")
     if not pending:
         st.info("No pending registration requests.")
     else:
-        df = pd.DataFrame([
+        st.dataframe([
             {"Email": email, "Phone": info["phone"], "Submitted": info["submitted_at"]}
             for email, info in pending.items()
-        ])
-        st.dataframe(df, use_container_width=True)
+        ], use_container_width=True)
 
         selected_email = st.selectbox("Select an email to review:", list(pending.keys()))
         if selected_email:
@@ -410,25 +685,46 @@ def page_admin():
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("✅ Approve homeowner"):
-                    users[selected_email] = {"phone": info["phone"], "password": info["password"]}
-                    save_json(USERS_FILE, users)
-                    del pending[selected_email]
-                    save_json(PENDING_FILE, pending)
+                    approve_pending_user(selected_email)
                     st.success(f"Approved {selected_email}")
-                    st.rerun()
+                    st.rerun(scope="fragment")
             with col2:
                 if st.button("❌ Reject homeowner"):
-                    del pending[selected_email]
-                    save_json(PENDING_FILE, pending)
+                    reject_pending_user(selected_email)
                     st.warning(f"Rejected {selected_email}")
-                    st.rerun()
+                    st.rerun(scope="fragment")
+
+def page_admin():
+    st.title("🧑‍💼 Admin Dashboard - Approve New Accounts & Manage Security")
+
+    # 🔒 Admin login
+    if "admin_logged_in" not in st.session_state:
+        st.subheader("Admin Login Required")
+        username = st.text_input("Admin Username")
+        password = st.text_input("Admin Password", type="password")
+
+        if st.button("Login"):
+            admin_user = st.secrets["admin"]["username"]
+            admin_pass = st.secrets["admin"]["password"]
+            # Non-short-circuit & so both checks always run
+            if hmac.compare_digest(username.encode(), admin_user.encode()) & hmac.compare_digest(
+                password.encode(), admin_pass.encode()
+            ):
+                st.session_state["admin_logged_in"] = True
+                st.success("✅ Logged in as Admin")
+                st.rerun()
+            else:
+                st.error("Invalid admin credentials.")
+        return
+
+    # ---- Main Admin UI ----
+    pending_registrations_panel()
 
     st.markdown("---")
     st.subheader("Security Accounts (create / list)")
     accounts = load_security_accounts()
     if accounts:
-        df_sec = pd.DataFrame([{"Username": a["username"]} for a in accounts])
-        st.table(df_sec)
+        st.table([{"Username": a["username"]} for a in accounts])
     else:
         st.info("No security accounts yet.")
 
@@ -474,13 +770,8 @@ def main(public_url):
 
     st.sidebar.divider()
     if st.sidebar.button("🚪 Logout"):
-        keys_to_keep = [k for k in st.session_state.keys() if k.startswith("security")]
-        all_keys = list(st.session_state.keys())
-        for k in all_keys:
-            if not k.startswith("security"):
-                st.session_state.pop(k, None)
-        for k in keys_to_keep:
-            pass
+        for k in ("logged_in", "email", "phone", "show_login"):
+            st.session_state.pop(k, None)
         st.success("Logged out successfully.")
         st.rerun()
 
@@ -490,8 +781,6 @@ def main(public_url):
 # Run App
 # ---------------------------
 if __name__ == "__main__":
-    ensure_security_file()
-
     st.session_state.setdefault(
         "public_url", "https://app-qrcode-kbtgae6rj8r2qrdxprggcm.streamlit.app/"
     )